@@ -8,3 +8,11 @@ LOG_CHANNEL_ID = -1004728126086  # Your log channel ID
 
 # Other Settings
 MAX_FILE_SIZE = 20 * 1024 * 1024  # 20MB
+EXTRACT_BATCH_SIZE = 200  # Max message IDs per get_messages call (API limit)
+EXTRACT_MAX_RANGE = 10000  # Max message IDs per /extract_range command
+EXTRACT_PROGRESS_INTERVAL = 5  # Min seconds between progress message edits
+
+# Shutdown Settings
+DRAIN_TIMEOUT = 30  # Seconds to let in-flight handlers finish on SIGTERM
+SESSION_STATE_FILE = "session_state.pickle"  # Extractor/HTML sessions carried across restarts
+CONVERSATION_STATE_FILE = "conversations.pickle"  # PTB conversation persistence
@@ -1,11 +1,23 @@
 import sys
 import os
 import asyncio
+import functools
+import pickle
 import signal
 import logging
 from typing import Optional
 from pyrogram import Client, filters
 from pyrogram.types import Message, MessageEntity
+from pyrogram.enums import ChatMemberStatus
+from pyrogram.errors import (
+    FloodWait,
+    MessageNotModified,
+    UserNotParticipant,
+    PeerIdInvalid,
+    UsernameNotOccupied,
+    ChannelPrivate,
+    ChatAdminRequired
+)
 from telegram import Update, Bot
 from telegram.ext import (
     Application,
@@ -14,11 +26,25 @@ from telegram.ext import (
     filters as tg_filters,
     ConversationHandler,
     ContextTypes,
+    PicklePersistence,
 )
 from telegram.constants import ParseMode
-from config import API_ID, API_HASH, BOT_TOKEN, LOG_CHANNEL_ID
+from config import (
+    API_ID,
+    API_HASH,
+    BOT_TOKEN,
+    LOG_CHANNEL_ID,
+    EXTRACT_BATCH_SIZE,
+    EXTRACT_MAX_RANGE,
+    EXTRACT_PROGRESS_INTERVAL,
+    DRAIN_TIMEOUT,
+    SESSION_STATE_FILE,
+    CONVERSATION_STATE_FILE
+)
 from utils.helpers import (
     escape_markdown,
+    extract_text_links,
+    extract_text_links_batch,
     get_correct_username,
     log_to_channel,
     transform_mpd_links,
@@ -36,27 +62,123 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # --- Signal Handlers ---
-async def shutdown(signal, loop):
-    """Cleanup tasks tied to the service's shutdown."""
-    logger.info(f"Received exit signal {signal.name}...")
+async def shutdown(signal, loop, shutdown_event: asyncio.Event):
+    """Start a graceful drain; a second signal cancels everything immediately."""
+    if not shutdown_event.is_set():
+        logger.info(f"Received exit signal {signal.name}, draining...")
+        shutdown_event.set()
+        return
+
+    logger.warning(f"Received exit signal {signal.name} again, forcing shutdown")
     tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
     [task.cancel() for task in tasks]
     logger.info(f"Cancelling {len(tasks)} outstanding tasks")
     await asyncio.gather(*tasks, return_exceptions=True)
     loop.stop()
 
-def add_signal_handlers():
+def add_signal_handlers(shutdown_event: asyncio.Event):
     loop = asyncio.get_running_loop()
     for s in (signal.SIGTERM, signal.SIGINT):
         loop.add_signal_handler(
             s,
-            lambda s=s: asyncio.create_task(shutdown(s, loop)))
+            lambda s=s: asyncio.create_task(shutdown(s, loop, shutdown_event)))
+
+# --- Graceful Drain ---
+draining = False
+inflight_tasks = set()
+
+def track_inflight(func):
+    """Run a handler in its own task so drain() can wait for (or abandon) it."""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        task = asyncio.create_task(func(*args, **kwargs))
+        inflight_tasks.add(task)
+        task.add_done_callback(inflight_tasks.discard)
+        await asyncio.wait((task,))
+        return None if task.cancelled() else task.result()
+    return wrapper
+
+def should_reject_while_draining(_, __, message: Message) -> bool:
+    """Turn away commands and in-session messages; ignore everything else as usual."""
+    if not draining:
+        return False
+    text = message.text or ""
+    return text.startswith("/") or get_safe_user_id(message) in user_sessions
+
+async def setup_drain_gate(client: Client):
+    @client.on_message(filters.private & filters.create(should_reject_while_draining), group=-1)
+    async def reject_while_draining(client: Client, message: Message):
+        try:
+            await message.reply_text("🔄 Bot is restarting, please send that again in a moment.")
+        except Exception as e:
+            logger.error(f"Error in reject_while_draining: {e}")
+        message.stop_propagation()
+
+async def drain(ptb_application: Application) -> int:
+    """Stop intake, wait for in-flight handlers and return how many were abandoned.
+
+    Sessions are snapshotted by main() only after PTB has stopped, so the
+    snapshot and the persisted conversation states agree.
+    """
+    global draining
+    draining = True
+
+    try:
+        if ptb_application.updater and ptb_application.updater.running:
+            await ptb_application.updater.stop()
+    except Exception as e:
+        logger.error(f"Error stopping PTB updater: {e}")
+
+    pending = set()
+    if inflight_tasks:
+        logger.info(f"Waiting up to {DRAIN_TIMEOUT}s for {len(inflight_tasks)} in-flight handlers")
+        _, pending = await asyncio.wait(set(inflight_tasks), timeout=DRAIN_TIMEOUT)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    return len(pending)
+
+def save_session_state():
+    """Snapshot link extractor and HTML sessions so the next process can resume them."""
+    state = {"user_sessions": user_sessions, "html_user_data": html_user_data}
+    if not any(state.values()):
+        return
+    try:
+        with open(SESSION_STATE_FILE, "wb") as file:
+            pickle.dump(state, file)
+        logger.info(f"Saved {len(user_sessions)} extractor and {len(html_user_data)} HTML sessions")
+    except Exception as e:
+        logger.error(f"Failed to save session state: {e}")
+
+def load_session_state(bot: Bot):
+    """Restore sessions snapshotted by a previous process, if any."""
+    if not os.path.exists(SESSION_STATE_FILE):
+        return
+    try:
+        with open(SESSION_STATE_FILE, "rb") as file:
+            state = pickle.load(file)
+        user_sessions.update(state.get("user_sessions", {}))
+        html_user_data.update(state.get("html_user_data", {}))
+        for data in html_user_data.values():
+            if 'document' in data:
+                data['document'].set_bot(bot)
+        os.remove(SESSION_STATE_FILE)
+        logger.info(f"Restored {len(user_sessions)} extractor and {len(html_user_data)} HTML sessions")
+    except Exception as e:
+        logger.error(f"Failed to load session state: {e}")
+        try:
+            os.replace(SESSION_STATE_FILE, f"{SESSION_STATE_FILE}.bad")
+            logger.error(f"Moved unreadable session state to {SESSION_STATE_FILE}.bad")
+        except OSError as e:
+            logger.error(f"Failed to move aside session state: {e}")
 
 # --- Link Extractor Module (Pyrogram) ---
 user_sessions = {}
 
 async def setup_link_extractor(client: Client):
     @client.on_message(filters.command("extract_txt"))
+    @track_inflight
     async def start_collecting(client: Client, message: Message):
         try:
             user_id = get_safe_user_id(message)
@@ -73,34 +195,127 @@ async def setup_link_extractor(client: Client):
         except Exception as e:
             logger.error(f"Error in start_collecting: {e}")
 
+    @client.on_message(filters.command("extract_range"))
+    @track_inflight
+    async def extract_range(client: Client, message: Message):
+        usage = (
+            "Usage: /extract_range <chat> <from_id> <to_id>\n"
+            f"At most {EXTRACT_MAX_RANGE} messages per command.\n"
+            "Example: /extract_range @mychannel 1 5000"
+        )
+        chat = last_id = last_done_id = None
+
+        async def report_stopped(reason):
+            if last_done_id is None:
+                await message.reply_text(f"❌ Extraction stopped: {reason}")
+            else:
+                await message.reply_text(
+                    f"❌ Extraction stopped after message {last_done_id}: {reason}\n"
+                    f"Messages up to {last_done_id} are in your session. Resume with:\n"
+                    f"/extract_range {chat} {last_done_id + 1} {last_id}"
+                )
+
+        try:
+            user_id = get_safe_user_id(message)
+            if user_id is None:
+                await message.reply_text("Error: Could not identify sender")
+                return
+
+            if len(message.command) < 4:
+                await message.reply_text(usage)
+                return
+
+            chat = message.command[1]
+            chat_id = int(chat) if chat.lstrip("-").isdigit() else chat
+            try:
+                first_id, last_id = int(message.command[2]), int(message.command[3])
+                if first_id < 1 or last_id < first_id:
+                    raise ValueError
+            except ValueError:
+                await message.reply_text("❌ Invalid message ID range. Use positive IDs with from <= to.")
+                return
+
+            total = last_id - first_id + 1
+            if total > EXTRACT_MAX_RANGE:
+                await message.reply_text(f"❌ Range too large ({total} messages).\n\n{usage}")
+                return
+
+            try:
+                target_chat = await client.get_chat(chat_id)
+                member = await client.get_chat_member(target_chat.id, user_id)
+                is_member = member.status not in (ChatMemberStatus.LEFT, ChatMemberStatus.BANNED)
+            except (UserNotParticipant, PeerIdInvalid, UsernameNotOccupied, ChannelPrivate, ChatAdminRequired, ValueError):
+                is_member = False
+
+            if not is_member or target_chat.id == LOG_CHANNEL_ID:
+                await message.reply_text("❌ You can only extract from chats you are a member of.")
+                return
+
+            if user_id not in user_sessions:
+                user_sessions[user_id] = {"messages": [], "filename": f"{user_id}_extracted.txt"}
+            session = user_sessions[user_id]
+
+            status = await message.reply_text(f"⏳ Extracting {total} messages from {chat}...")
+            loop = asyncio.get_running_loop()
+            last_edit = loop.time()
+            processed = collected = 0
+
+            async def update_status(text: str):
+                try:
+                    await status.edit_text(text)
+                except MessageNotModified:
+                    pass
+                except Exception as e:
+                    logger.warning(f"Failed to update extract_range progress: {e}")
+
+            for batch_start in range(first_id, last_id + 1, EXTRACT_BATCH_SIZE):
+                message_ids = list(range(batch_start, min(batch_start + EXTRACT_BATCH_SIZE, last_id + 1)))
+                while True:
+                    try:
+                        batch = await client.get_messages(target_chat.id, message_ids)
+                        break
+                    except FloodWait as e:
+                        await asyncio.sleep(e.value)
+
+                text_messages = [msg for msg in batch if not msg.empty and msg.text]
+                session["messages"].extend(extract_text_links_batch(text_messages))
+                collected += len(text_messages)
+                processed += len(message_ids)
+                last_done_id = message_ids[-1]
+
+                if processed < total and loop.time() - last_edit >= EXTRACT_PROGRESS_INTERVAL:
+                    last_edit = loop.time()
+                    await update_status(f"⏳ Processed {processed}/{total} messages, {collected} collected...")
+
+            await update_status(
+                f"✅ Processed {total} messages, {collected} collected.\n"
+                f"Send more messages or type /over to get {session['filename']}"
+            )
+        except asyncio.CancelledError:
+            logger.warning(f"extract_range cancelled after message {last_done_id}")
+            try:
+                await report_stopped("bot is restarting")
+            except Exception as e:
+                logger.error(f"Error reporting cancelled extract_range: {e}")
+            raise
+        except Exception as e:
+            logger.error(f"Error in extract_range: {e}")
+            await report_stopped(e)
+
     @client.on_message(filters.text & ~filters.command("over"))
+    @track_inflight
     async def collect_text(client: Client, message: Message):
         try:
             user_id = get_safe_user_id(message)
             if user_id is None or user_id not in user_sessions:
                 return
 
-            text = message.text
-            entities = message.entities if message.entities else []
-            formatted_entries = []
-            
-            if entities:
-                for entity in entities:
-                    if entity.type.name.lower() == "text_link":
-                        start = entity.offset
-                        end = start + entity.length
-                        link_text = text[start:end]
-                        url = entity.url
-                        formatted_entries.append(f"{link_text} : {url}")
-            
-            if formatted_entries:
-                user_sessions[user_id]["messages"].extend(formatted_entries)
-            else:
-                user_sessions[user_id]["messages"].append(text)
+            user_sessions[user_id]["messages"].extend(extract_text_links(message))
         except Exception as e:
             logger.error(f"Error in collect_text: {e}")
 
     @client.on_message(filters.command("over"))
+    @track_inflight
     async def stop_collecting(client: Client, message: Message):
         try:
             user_id = get_safe_user_id(message)
@@ -112,11 +327,13 @@ async def setup_link_extractor(client: Client):
                 await message.reply_text("You're not in a session. Use /extract_txt to start.")
                 return
             
-            session_data = user_sessions.pop(user_id)
+            # Keep the session until delivery succeeds so a drain can still snapshot it
+            session_data = user_sessions[user_id]
             filename = session_data["filename"]
             file_content = "\n".join(session_data["messages"])
             
             if not file_content.strip():
+                user_sessions.pop(user_id, None)
                 await message.reply_text("No content collected. File not generated.")
                 return
             
@@ -124,11 +341,13 @@ async def setup_link_extractor(client: Client):
                 file.write(file_content)
             
             await message.reply_document(filename)
+            user_sessions.pop(user_id, None)
             os.remove(filename)
         except Exception as e:
             logger.error(f"Error in stop_collecting: {e}")
 
     @client.on_message(filters.command("reset"))
+    @track_inflight
     async def reset_sessions(client: Client, message: Message):
         user_sessions.clear()
         await message.reply_text("All user sessions have been reset.")
@@ -136,6 +355,7 @@ async def setup_link_extractor(client: Client):
 # --- PW Link Changer Module ---
 ASK_FOR_FILE, ASK_FOR_TOKEN = range(2)
 
+@track_inflight
 async def pw_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         user = update.message.from_user
@@ -149,6 +369,7 @@ async def pw_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Error in pw_start: {e}")
         return ConversationHandler.END
 
+@track_inflight
 async def pw_handle_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         file = await update.message.document.get_file()
@@ -167,6 +388,7 @@ async def pw_handle_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Error in pw_handle_file: {e}")
         return ConversationHandler.END
 
+@track_inflight
 async def pw_handle_token(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         token = update.message.text
@@ -208,6 +430,12 @@ async def pw_handle_token(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 html_user_data = {}
 
+async def html_session_lost(update: Update) -> int:
+    """End a conversation whose html_user_data entry did not survive a restart."""
+    await update.message.reply_text("⚠️ Your HTML session was lost during a restart. Please start again with /html.")
+    return ConversationHandler.END
+
+@track_inflight
 async def html_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
         await update.message.reply_text(
@@ -218,6 +446,7 @@ async def html_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         logger.error(f"Error in html_start: {e}")
         return ConversationHandler.END
 
+@track_inflight
 async def get_filename(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
         filename = update.message.text.strip()
@@ -237,8 +466,11 @@ async def get_filename(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
         logger.error(f"Error in get_filename: {e}")
         return ConversationHandler.END
 
+@track_inflight
 async def get_title(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
+        if update.effective_user.id not in html_user_data:
+            return await html_session_lost(update)
         html_user_data[update.effective_user.id]['title'] = update.message.text
         await update.message.reply_text("Now send me your name")
         return GLITCH
@@ -246,8 +478,11 @@ async def get_title(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         logger.error(f"Error in get_title: {e}")
         return ConversationHandler.END
 
+@track_inflight
 async def get_glitch_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
+        if update.effective_user.id not in html_user_data:
+            return await html_session_lost(update)
         html_user_data[update.effective_user.id]['glitch'] = update.message.text
         await update.message.reply_text("Now send coaching platform name")
         return CLASS
@@ -255,8 +490,11 @@ async def get_glitch_text(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         logger.error(f"Error in get_glitch_text: {e}")
         return ConversationHandler.END
 
+@track_inflight
 async def get_class(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
+        if update.effective_user.id not in html_user_data:
+            return await html_session_lost(update)
         html_user_data[update.effective_user.id]['class'] = update.message.text
         await update.message.reply_text("Now send me sir name and chapter name")
         return HEADER
@@ -264,8 +502,11 @@ async def get_class(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         logger.error(f"Error in get_class: {e}")
         return ConversationHandler.END
 
+@track_inflight
 async def get_header(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
+        if update.effective_user.id not in html_user_data:
+            return await html_session_lost(update)
         html_user_data[update.effective_user.id]['header'] = update.message.text
         await update.message.reply_text(
             "📌 How do you want to send button links?\n\n"
@@ -278,6 +519,7 @@ async def get_header(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         logger.error(f"Error in get_header: {e}")
         return ConversationHandler.END
 
+@track_inflight
 async def handle_method_choice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
         choice = update.message.text.strip()
@@ -307,12 +549,15 @@ async def handle_method_choice(update: Update, context: ContextTypes.DEFAULT_TYP
         logger.error(f"Error in handle_method_choice: {e}")
         return ConversationHandler.END
 
+@track_inflight
 async def get_line_range(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
         if not update.message.document:
             await update.message.reply_text("❌ Please upload a .txt file first.")
             return LINE_RANGE
         
+        if update.effective_user.id not in html_user_data:
+            return await html_session_lost(update)
         html_user_data[update.effective_user.id]['document'] = update.message.document
         await update.message.reply_text("📝 Now send the line range you want to process (e.g. 1-10):")
         return BUTTON_PAIRS
@@ -320,9 +565,12 @@ async def get_line_range(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         logger.error(f"Error in get_line_range: {e}")
         return ConversationHandler.END
 
+@track_inflight
 async def get_button_pairs(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
         user_id = update.effective_user.id
+        if user_id not in html_user_data:
+            return await html_session_lost(update)
         data = html_user_data[user_id]
 
         if 'document' in data:
@@ -544,6 +792,7 @@ async def generate_html(update: Update, user_id: int) -> None:
     except Exception as e:
         logger.error(f"Error in generate_html: {e}")
 
+@track_inflight
 async def html_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
         if update.effective_user.id in html_user_data:
@@ -555,6 +804,7 @@ async def html_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
         return ConversationHandler.END
 
 # --- Main Bot Setup ---
+@track_inflight
 async def start_bot(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         user = update.message.from_user
@@ -565,8 +815,9 @@ async def start_bot(update: Update, context: ContextTypes.DEFAULT_TYPE):
             caption=(
                 "🤖 This Telegram Bot combines multiple functionalities:\n\n"
                 "1️⃣ /extract_txt - Extract text and links from messages\n"
-                "2️⃣ /pw - Convert PW DRM protected links\n"
-                "3️⃣ /html - Generate HTML files with button links\n\n"
+                "2️⃣ /extract_range - Bulk extract links from a chat's message ID range\n"
+                "3️⃣ /pw - Convert PW DRM protected links\n"
+                "4️⃣ /html - Generate HTML files with button links\n\n"
                 "Bot made by @ItsNomis"
             ),
             parse_mode=ParseMode.MARKDOWN_V2
@@ -585,6 +836,8 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def main():
     pyro_client = None
     ptb_application = None
+    drain_started = None
+    abandoned = 0
     
     try:
         # Initialize clients
@@ -595,12 +848,20 @@ async def main():
             bot_token=BOT_TOKEN
         )
         
-        ptb_application = Application.builder().token(BOT_TOKEN).build()
+        ptb_application = (
+            Application.builder()
+            .token(BOT_TOKEN)
+            .persistence(PicklePersistence(filepath=CONVERSATION_STATE_FILE))
+            .build()
+        )
+        load_session_state(ptb_application.bot)
         
         # Set up signal handlers
-        add_signal_handlers()
+        shutdown_event = asyncio.Event()
+        add_signal_handlers(shutdown_event)
         
         # Set up all modules
+        await setup_drain_gate(pyro_client)
         await setup_link_extractor(pyro_client)
         
         # PW Link Changer
@@ -611,6 +872,8 @@ async def main():
                 ASK_FOR_TOKEN: [MessageHandler(tg_filters.TEXT & ~tg_filters.COMMAND, pw_handle_token)],
             },
             fallbacks=[CommandHandler("cancel", html_cancel)],
+            name="pw_conversation",
+            persistent=True,
         )
         ptb_application.add_handler(pw_conv_handler)
         
@@ -631,6 +894,8 @@ async def main():
                 ],
             },
             fallbacks=[CommandHandler("cancel", html_cancel)],
+            name="html_conversation",
+            persistent=True,
         )
         ptb_application.add_handler(html_conv_handler)
         
@@ -647,8 +912,10 @@ async def main():
         
         logger.info("Bot started successfully")
         
-        # Run forever
-        await asyncio.Event().wait()
+        # Run until a shutdown signal arrives, then drain
+        await shutdown_event.wait()
+        drain_started = asyncio.get_running_loop().time()
+        abandoned = await drain(ptb_application)
         
     except asyncio.CancelledError:
         logger.info("Main task cancelled")
@@ -657,7 +924,9 @@ async def main():
     finally:
         try:
             if ptb_application:
-                await ptb_application.stop()
+                if ptb_application.running:
+                    await ptb_application.stop()
+                await ptb_application.shutdown()
                 logger.info("PTB application stopped")
         except Exception as e:
             logger.error(f"Error stopping PTB application: {e}")
@@ -669,5 +938,10 @@ async def main():
         except Exception as e:
             logger.error(f"Error stopping Pyrogram client: {e}")
 
+        if drain_started is not None:
+            save_session_state()
+            elapsed = asyncio.get_running_loop().time() - drain_started
+            logger.info(f"Drained in {elapsed:.2f}s, abandoned {abandoned} in-flight handlers")
+
 if __name__ == "__main__":
     asyncio.run(main())
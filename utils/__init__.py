@@ -1,5 +1,8 @@
 from .helpers import (
     escape_markdown,
+    escape_markdown_batch,
+    extract_text_links,
+    extract_text_links_batch,
     get_correct_username,
     log_to_channel,
     transform_mpd_links,
@@ -8,6 +11,9 @@ from .helpers import (
 
 __all__ = [
     'escape_markdown',
+    'escape_markdown_batch',
+    'extract_text_links',
+    'extract_text_links_batch',
     'get_correct_username',
     'log_to_channel',
     'transform_mpd_links',
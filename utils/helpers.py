@@ -2,9 +2,10 @@ import html
 import re
 import logging
 from datetime import datetime
-from typing import Optional, Union
+from typing import Iterable, List, Optional, Union
 from telegram import Bot, InputFile
 from telegram.constants import ParseMode
+from pyrogram.enums import MessageEntityType
 from pyrogram.types import Message
 from config import LOG_CHANNEL_ID
 
@@ -12,18 +13,58 @@ from config import LOG_CHANNEL_ID
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Precompiled at import so hot paths never rebuild tables or patterns
+_MARKDOWN_V1_TABLE = str.maketrans({c: '\\' + c for c in '_*`['})
+_MARKDOWN_V2_TABLE = str.maketrans({c: '\\' + c for c in '_*[]()~`>#+-=|{}.!'})
+_BATCH_SEPARATOR = '\x00'  # Not in either escape table, so it survives translate()
+_MPD_LINK_PATTERN = re.compile(r"https://[a-zA-Z0-9.-]+/([\w-]+)/master\.mpd")
+
 def get_safe_user_id(message: Message) -> Optional[int]:
     """Safely get user ID from a message, handling None cases."""
     return message.from_user.id if message.from_user else None
 
+def _markdown_table(version: int) -> dict:
+    """Return the precompiled escape table for a Markdown version."""
+    return _MARKDOWN_V1_TABLE if version == 1 else _MARKDOWN_V2_TABLE
+
+def extract_text_links_batch(messages: Iterable[Message]) -> List[str]:
+    """Extract text_link entities from messages as "text : url" entries.
+
+    A message with no text links contributes its plain text instead.
+    Entries are flattened in message order. This is a convenience wrapper
+    that handles each message in turn; it is not faster than a loop.
+    """
+    entries = []
+    for message in messages:
+        text = message.text
+        links = [
+            f"{text[entity.offset:entity.offset + entity.length]} : {entity.url}"
+            for entity in message.entities or []
+            if entity.type == MessageEntityType.TEXT_LINK
+        ]
+        entries.extend(links if links else [text])
+    return entries
+
+def extract_text_links(message: Message) -> List[str]:
+    """Extract text_link entries from a single message."""
+    return extract_text_links_batch([message])
+
+def escape_markdown_batch(texts: Iterable[str], version: int = 2) -> List[str]:
+    """Escape special Markdown characters in a list of strings.
+
+    The strings are joined and escaped with a single translate() call,
+    falling back to per-item escaping if one contains the separator.
+    """
+    texts = list(texts)
+    table = _markdown_table(version)
+    escaped = _BATCH_SEPARATOR.join(texts).translate(table).split(_BATCH_SEPARATOR)
+    if len(escaped) != len(texts):
+        return [text.translate(table) for text in texts]
+    return escaped
+
 def escape_markdown(text: str, version: int = 2) -> str:
     """Escape special Markdown characters."""
-    if version == 1:
-        special_chars = ['_', '*', '`', '[']
-    else:  # version 2
-        special_chars = ['_', '*', '[', ']', '(', ')', '~', '`', '>', '#', '+', '-', '=', '|', '{', '}', '.', '!']
-    
-    return re.sub('|'.join(map(re.escape, special_chars)), lambda m: '\\' + m.group(), text)
+    return escape_markdown_batch([text], version)[0]
 
 def get_correct_username(user) -> str:
     """Get the best available username representation."""
@@ -55,18 +96,22 @@ async def log_to_channel(
         username = get_correct_username(user)
         time_str = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         
+        full_name, username, filename, extra_info = escape_markdown_batch(
+            [user.full_name, username, filename or "", extra_info or ""]
+        )
+        
         log_lines = [
             f"📄 {action}",
-            f"👤 User: {escape_markdown(user.full_name)}",
+            f"👤 User: {full_name}",
             f"🆔 ID: {user.id}",
-            f"📌 Username: {escape_markdown(username)}",
+            f"📌 Username: {username}",
             f"🕒 Time: {time_str}"
         ]
         
         if filename:
-            log_lines.append(f"📁 File: {escape_markdown(filename)}")
+            log_lines.append(f"📁 File: {filename}")
         if extra_info:
-            log_lines.append(f"ℹ️ Info: {escape_markdown(extra_info)}")
+            log_lines.append(f"ℹ️ Info: {extra_info}")
         
         log_message = "\n\n".join(log_lines)
         
@@ -91,15 +136,7 @@ async def log_to_channel(
 
 def transform_mpd_links(content: str, token: str) -> str:
     """Transform .mpd links to the new format."""
-    try:
-        mpd_links = re.findall(r"(https://[a-zA-Z0-9.-]+/[\w-]+/master\.mpd)", content)
-        for original_link in mpd_links:
-            video_id_match = re.search(r"https://[a-zA-Z0-9.-]+/([\w-]+)/master\.mpd", original_link)
-            if video_id_match:
-                video_id = video_id_match.group(1)
-                new_link = f"https://madxabhi-pw.onrender.com/{video_id}/master.m3u8?token={token}"
-                content = content.replace(original_link, new_link)
-        return content
-    except re.error as e:
-        logger.error(f"Regex error in link transformation: {e}")
-        return content
+    return _MPD_LINK_PATTERN.sub(
+        lambda m: f"https://madxabhi-pw.onrender.com/{m.group(1)}/master.m3u8?token={token}",
+        content
+    )